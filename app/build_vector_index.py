@@ -1,17 +1,79 @@
 # app/build_vector_index.py
 
+import csv
+import hashlib
+import io
 import os
 import numpy as np
 import faiss
+import torch
 from sentence_transformers import SentenceTransformer
 
-from app.db import SessionLocal
+from app.db import SessionLocal, engine
+from app.ingest import available_cpus
 from app.models import CodeChunk
 
 MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
+INSERT_BATCH_SIZE = 1000
+
+CHUNK_COLUMNS = (
+    "user_id", "chunk_index", "file_name", "symbol_name",
+    "start_line", "end_line", "code_snippet", "content_hash",
+)
+
+# HNSW graph params (vectors are normalized → inner product == cosine)
+HNSW_M = 32
+HNSW_EF_CONSTRUCTION = 64
+
+# Pick the fastest available device once at import
+if torch.cuda.is_available():
+    device = "cuda"
+elif torch.backends.mps.is_available():
+    device = "mps"
+else:
+    device = "cpu"
 
 # Load model globally once (fast)
-model = SentenceTransformer(MODEL_NAME)
+model = SentenceTransformer(MODEL_NAME, device=device)
+
+if device == "cuda":
+    model.half()   # FP16 on GPU — MiniLM retrieval is tolerant of it
+elif device == "cpu":
+    torch.set_num_threads(available_cpus())
+
+# Bigger batches only pay off on accelerators
+ENCODE_BATCH_SIZE = 256 if device != "cpu" else 64
+
+
+def _copy_chunk_rows(conn, rows: list):
+    """
+    Stream rows into code_chunks with PostgreSQL COPY (psycopg2 only).
+    NULLs are written as \\N so empty strings survive the round trip.
+    """
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    for row in rows:
+        writer.writerow(["\\N" if row[col] is None else row[col] for col in CHUNK_COLUMNS])
+    buf.seek(0)
+
+    cursor = conn.connection.cursor()
+    try:
+        cursor.copy_expert(
+            f"COPY code_chunks ({', '.join(CHUNK_COLUMNS)}) "
+            "FROM STDIN WITH (FORMAT csv, NULL '\\N')",
+            buf,
+        )
+    finally:
+        cursor.close()
+
+
+def _insert_chunk_rows(conn, rows: list):
+    """
+    Portable fallback: Core executemany in batches.
+    """
+    insert_stmt = CodeChunk.__table__.insert()
+    for start in range(0, len(rows), INSERT_BATCH_SIZE):
+        conn.execute(insert_stmt, rows[start:start + INSERT_BATCH_SIZE])
 
 
 def build_faiss_index(user_id: str, chunks: list):
@@ -20,6 +82,7 @@ def build_faiss_index(user_id: str, chunks: list):
 
     ✔ Supports ONE repo per user
     ✔ Deletes previous FAISS + metadata
+    ✔ Reuses embeddings of unchanged chunks (matched by content_hash)
     ✔ Stores FAISS under: app/repos/<user_id>/faiss/
     ✔ Does NOT save chunks.json or metadata.json
     """
@@ -33,19 +96,57 @@ def build_faiss_index(user_id: str, chunks: list):
     if not chunks:
         raise ValueError("[FAISS ERROR] No chunks received. Repo may be empty or unsupported.")
 
+    texts = [c.get("text_to_embed", "") for c in chunks]
+    hashes = [hashlib.sha1(t.encode("utf-8")).hexdigest() for t in texts]
+
     # ============================================================
-    # STEP 1 — Delete old FAISS files + DB metadata
+    # STEP 1 — Collect reusable embeddings from the previous build
     # ============================================================
 
     session = SessionLocal()
 
-    print("[DB] Removing old metadata for this user...")
-    session.query(CodeChunk).filter(CodeChunk.user_id == user_id).delete()
-    session.commit()
-
     # Prepare FAISS folder
     base_dir = f"app/repos/{user_id}/faiss"
     os.makedirs(base_dir, exist_ok=True)
+    emb_path = os.path.join(base_dir, "embeddings.npy")
+
+    previous = dict(
+        session.query(CodeChunk.content_hash, CodeChunk.chunk_index)
+        .filter(CodeChunk.user_id == user_id, CodeChunk.content_hash.isnot(None))
+        .all()
+    )
+
+    dim = model.get_sentence_embedding_dimension()
+    embeddings = np.empty((len(texts), dim), dtype=np.float32)
+    missing = list(range(len(texts)))
+
+    if previous and os.path.exists(emb_path):
+        old = np.load(emb_path, mmap_mode="r")
+
+        if old.ndim == 2 and old.shape[1] == dim:
+            reuse_dst, reuse_src, missing = [], [], []
+            for i, h in enumerate(hashes):
+                j = previous.get(h)
+                if j is not None and j < len(old):
+                    reuse_dst.append(i)
+                    reuse_src.append(j)
+                else:
+                    missing.append(i)
+
+            if reuse_dst:
+                embeddings[reuse_dst] = old[reuse_src]
+
+        del old
+
+    print(f"[FAISS] Reusing {len(texts) - len(missing)} unchanged embeddings.")
+
+    # ============================================================
+    # STEP 2 — Delete old FAISS files + DB metadata
+    # ============================================================
+
+    print("[DB] Removing old metadata for this user...")
+    session.query(CodeChunk).filter(CodeChunk.user_id == user_id).delete()
+    session.commit()
 
     # Clean old FAISS files
     for file in ["embeddings.npy", "code_index.faiss"]:
@@ -54,30 +155,41 @@ def build_faiss_index(user_id: str, chunks: list):
             os.remove(path)
 
     # ============================================================
-    # STEP 2 — Generate embeddings
+    # STEP 3 — Generate embeddings for new / changed chunks
     # ============================================================
 
-    print(f"[FAISS] Generating embeddings for {len(chunks)} chunks...")
-
-    texts = [c.get("text_to_embed", "") for c in chunks]
-
-    embeddings = model.encode(
-        texts,
-        batch_size=32,
-        convert_to_numpy=True,
-        normalize_embeddings=True
-    ).astype("float32")
+    print(f"[FAISS] Generating embeddings for {len(missing)} chunks...")
+
+    if missing:
+        # No manual length-sort needed: encode() already orders a list input by
+        # text length before batching (minimal padding) and restores the
+        # original order, so rows stay aligned with `missing`.
+        embeddings[missing] = model.encode(
+            [texts[i] for i in missing],
+            batch_size=ENCODE_BATCH_SIZE,
+            convert_to_numpy=True,
+            normalize_embeddings=True
+        )
 
-    # Save embeddings (optional but useful for debugging)
-    emb_path = os.path.join(base_dir, "embeddings.npy")
+    # Save embeddings (reused by the next build, also handy for debugging)
     np.save(emb_path, embeddings)
 
+    # Swap the in-RAM array for a memmap of the file just written so the
+    # encoder output isn't held alongside FAISS's own copy of the vectors.
+    # Copy-on-write keeps the buffer writable for FAISS's swig bindings.
+    del embeddings
+    embeddings = np.load(emb_path, mmap_mode="c")
+
     # ============================================================
-    # STEP 3 — Create FAISS index
+    # STEP 4 — Create FAISS index
     # ============================================================
 
-    dim = embeddings.shape[1]
-    index = faiss.IndexFlatIP(dim)
+    # HNSW graph over FP16-quantized vectors: half the storage/bandwidth of FP32
+    index = faiss.IndexHNSWSQ(
+        dim, faiss.ScalarQuantizer.QT_fp16, HNSW_M, faiss.METRIC_INNER_PRODUCT
+    )
+    index.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+    index.train(embeddings)
     index.add(embeddings)
 
     faiss_path = os.path.join(base_dir, "code_index.faiss")
@@ -86,30 +198,38 @@ def build_faiss_index(user_id: str, chunks: list):
     print("[FAISS] Index built and stored successfully.")
 
     # ============================================================
-    # STEP 4 — Store metadata into PostgreSQL
+    # STEP 5 — Store metadata into PostgreSQL
     # ============================================================
 
     print("[DB] Storing metadata in PostgreSQL...")
 
-    for i, c in enumerate(chunks):
-        entry = CodeChunk(
-            user_id=user_id,
-            chunk_index=i,
-            file_name=c.get("file"),
-            symbol_name=c.get("name"),
-            start_line=c.get("lineno_start"),
-            end_line=c.get("lineno_end"),
-            code_snippet=c.get("code")
-        )
-        session.add(entry)
+    rows = [
+        {
+            "user_id": user_id,
+            "chunk_index": i,
+            "file_name": c.get("file"),
+            "symbol_name": c.get("name"),
+            "start_line": c.get("lineno_start"),
+            "end_line": c.get("lineno_end"),
+            "code_snippet": c.get("code"),
+            "content_hash": hashes[i],
+        }
+        for i, c in enumerate(chunks)
+    ]
+
+    # COPY on PostgreSQL (fresh load, no conflicts), executemany elsewhere
+    with engine.begin() as conn:
+        if engine.dialect.driver == "psycopg2":
+            _copy_chunk_rows(conn, rows)
+        else:
+            _insert_chunk_rows(conn, rows)
 
-    session.commit()
     session.close()
 
     print(f"[FAISS] Metadata stored. Total chunks: {len(chunks)}")
 
     # ============================================================
-    # STEP 5 — Return summary
+    # STEP 6 — Return summary
     # ============================================================
 
     return {
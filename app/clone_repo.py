@@ -14,7 +14,12 @@ def clone_repo_for_user(user_id: str, github_url: str) -> str:
     print(f"[CLONE] Cloning into: {temp_repo}")
 
     try:
-        Repo.clone_from(github_url, temp_repo)
+        # Ingest only needs HEAD → shallow, partial, single-branch clone
+        Repo.clone_from(
+            github_url,
+            temp_repo,
+            multi_options=["--depth=1", "--filter=blob:none", "--single-branch"],
+        )
     except GitCommandError as e:
         raise RuntimeError(f"Git clone failed: {e}")
 
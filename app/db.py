@@ -1,7 +1,7 @@
 # app/db.py
 
 import os
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, text
 from sqlalchemy.orm import sessionmaker, declarative_base
 
 DATABASE_URL = os.getenv("DATABASE_URL")
@@ -12,6 +12,10 @@ if not DATABASE_URL:
 engine = create_engine(
     DATABASE_URL,
     pool_pre_ping=True,   # ✅ important for Render / cloud
+    pool_size=10,         # steady-state connections for API concurrency
+    max_overflow=20,      # headroom for ingest bursts
+    pool_recycle=1800,    # drop connections before the server idles them out
+    pool_use_lifo=True,   # reuse hot connections, let extras age out
 )
 
 SessionLocal = sessionmaker(
@@ -21,3 +25,18 @@ SessionLocal = sessionmaker(
 )
 
 Base = declarative_base()
+
+
+def init_db():
+    # Import models so their tables are registered on Base.metadata
+    from app import models  # noqa: F401
+
+    Base.metadata.create_all(bind=engine)
+
+    # create_all never alters existing tables → idempotent in-place upgrades
+    with engine.begin() as conn:
+        conn.execute(text(
+            "ALTER TABLE code_chunks ADD COLUMN IF NOT EXISTS content_hash VARCHAR(40)"
+        ))
+        # Hashes are matched in Python, never filtered in SQL — no index needed
+        conn.execute(text("DROP INDEX IF EXISTS ix_code_chunks_content_hash"))
@@ -1,136 +1,218 @@
 # app/ingest.py
 
 import ast
+import multiprocessing
 import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
 
 
 # ================================================================
 # === PART 1 — PYTHON AST PARSING ================================
 # ================================================================
 
-def get_names_from_calls(node):
-    calls = []
+_SCALAR_CONST_TYPES = (str, int, float)
+
+# The embedder truncates at 256 tokens anyway; cap chars so the tokenizer
+# doesn't chew through huge Calls/Vars/Consts lists for nothing.
+MAX_EMBED_CHARS = 2000
+
+
+def extract_features(node):
+    """
+    One walk over a function subtree, collecting:
+    - called names (plain calls + attribute calls)
+    - referenced variable names
+    - scalar constants (str / int / float)
+    """
+    calls = set()
+    names = set()
+    consts = set()
+
+    # Local bindings: skip global/attribute lookups inside the hot loop
+    Call, Name, Attribute, Constant = ast.Call, ast.Name, ast.Attribute, ast.Constant
+    scalar_types = _SCALAR_CONST_TYPES
+
     for child in ast.walk(node):
-        if isinstance(child, ast.Call):
-            if isinstance(child.func, ast.Name):
-                calls.append(child.func.id)
-            elif isinstance(child.func, ast.Attribute):
-                calls.append(child.func.attr)
-    return list(set(calls))
+        t = type(child)
+        if t is Call:
+            func = child.func
+            if type(func) is Name:
+                calls.add(func.id)
+            elif type(func) is Attribute:
+                calls.add(func.attr)
+        elif t is Name:
+            names.add(child.id)
+        elif t is Constant and isinstance(child.value, scalar_types):
+            consts.add(child.value)
 
+    return calls, names, consts
 
-def get_variable_names(node):
-    return list({n.id for n in ast.walk(node) if isinstance(n, ast.Name)})
 
+_FUNC_TYPES = (ast.FunctionDef, ast.AsyncFunctionDef)
 
-def get_constants(node):
-    consts = set()
-    for c in ast.walk(node):
-        if isinstance(c, ast.Constant) and isinstance(c.value, (str, int, float)):
-            consts.add(c.value)
-    return list(consts)
+# Only statement lists can hold class / function definitions, so the walk
+# never descends into expressions (deep BinOp chains etc.).
+# Listed in source order (try/except/else/finally) so chunks come out in order.
+_STMT_FIELDS = ("body", "handlers", "orelse", "finalbody", "cases")
 
 
-def parse_python_file(file_path):
-    try:
-        source = open(file_path, "r", encoding="utf-8").read()
-    except:
-        return []
+class ChunkCollector:
+    """
+    Single-pass collector for class / function / method chunks.
+    Walks statement lists with an explicit stack, carrying the enclosing
+    class along so each function knows its parent without re-walking the
+    tree, and without Python recursion limits on deeply nested code.
+    """
 
-    try:
-        tree = ast.parse(source)
-    except SyntaxError:
-        return []
+    def __init__(self, source, file_path):
+        # AST col offsets are UTF-8 byte offsets, so slice the encoded source
+        self.source_bytes = source.encode("utf-8")
+        newlines = np.flatnonzero(np.frombuffer(self.source_bytes, dtype=np.uint8) == 0x0A)
+        self.line_offsets = np.concatenate(([0], newlines + 1)).tolist()
+
+        self.file_name = os.path.basename(file_path)
+        self.chunks = []
+
+    def source_segment(self, node):
+        """
+        Same text as ast.get_source_segment, from line offsets computed once
+        per file instead of re-splitting the source for every node.
+        """
+        start = self.line_offsets[node.lineno - 1] + node.col_offset
+        end = self.line_offsets[node.end_lineno - 1] + node.end_col_offset
+        return self.source_bytes[start:end].decode("utf-8", errors="ignore")
+
+    def collect(self, tree):
+        # (node, enclosing class name or None when directly inside a function)
+        stack = [(tree, None)]
+
+        while stack:
+            node, parent_class = stack.pop()
+
+            if isinstance(node, ast.ClassDef):
+                self.add_class(node)
+                scope = node.name
+            elif isinstance(node, _FUNC_TYPES):
+                self.add_function(node, parent_class)
+                scope = None
+            else:
+                scope = parent_class
+
+            children = []
+            for field in _STMT_FIELDS:
+                value = getattr(node, field, None)
+                if isinstance(value, list):
+                    children.extend(value)
+
+            # Reversed so chunks come out in source order
+            stack.extend((child, scope) for child in reversed(children))
+
+        return self.chunks
+
+    def add_class(self, node):
+        code = self.source_segment(node)
+        snippet = code[:250].replace("\n", " ")
 
-    chunks = []
+        self.chunks.append({
+            "kind": "class",
+            "name": node.name,
+            "file": self.file_name,
+            "lineno_start": node.lineno,
+            "lineno_end": node.end_lineno,
+            "code": code,
+            "text_to_embed": f"Class: {node.name}\nSnippet: {snippet}"
+        })
+
+    def add_function(self, node, parent_class):
+        code = self.source_segment(node)
+        snippet = code[:250].replace("\n", " ")
 
-    for node in ast.walk(tree):
-
-        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
-            code = ast.get_source_segment(source, node) or ""
-            snippet = code[:250].replace("\n", " ")
-
-            parent_class = None
-            for parent in ast.walk(tree):
-                if isinstance(parent, ast.ClassDef) and node in parent.body:
-                    parent_class = parent.name
-
-            chunks.append({
-                "kind": "method" if parent_class else "function",
-                "name": node.name,
-                "class": parent_class,
-                "file": os.path.basename(file_path),
-                "lineno_start": node.lineno,
-                "lineno_end": node.end_lineno,
-                "code": code,
-                "text_to_embed": f"""
+        calls, names, consts = extract_features(node)
+
+        # Sorted joins: set order varies with PYTHONHASHSEED, and the text
+        # must be stable across processes for content_hash reuse to hit
+        calls_text = ', '.join(sorted(calls))
+        names_text = ', '.join(sorted(names))
+        consts_text = ', '.join(sorted(map(str, consts)))
+
+        self.chunks.append({
+            "kind": "method" if parent_class else "function",
+            "name": node.name,
+            "class": parent_class,
+            "file": self.file_name,
+            "lineno_start": node.lineno,
+            "lineno_end": node.end_lineno,
+            "code": code,
+            "text_to_embed": f"""
 Function: {node.name}
 Class: {parent_class or "None"}
 Args: {', '.join(a.arg for a in node.args.args)}
-Calls: {', '.join(get_names_from_calls(node))}
-Vars: {', '.join(get_variable_names(node))}
-Consts: {', '.join(map(str, get_constants(node)))}
+Calls: {calls_text}
+Vars: {names_text}
+Consts: {consts_text}
 Snippet: {snippet}
-""".strip()
-            })
-
-        elif isinstance(node, ast.ClassDef):
-            code = ast.get_source_segment(source, node) or ""
-            snippet = code[:250].replace("\n", " ")
-
-            chunks.append({
-                "kind": "class",
-                "name": node.name,
-                "file": os.path.basename(file_path),
-                "lineno_start": node.lineno,
-                "lineno_end": node.end_lineno,
-                "code": code,
-                "text_to_embed": f"Class: {node.name}\nSnippet: {snippet}"
-            })
+""".strip()[:MAX_EMBED_CHARS]
+        })
 
-    return chunks
+
+def parse_python_file(file_path, source: str):
+    try:
+        tree = ast.parse(source)
+    except SyntaxError:
+        return []
+
+    return ChunkCollector(source, file_path).collect(tree)
 
 
 # ================================================================
 # === PART 2 — GENERIC CODE FALLBACK (NO TREE-SITTER) ============
 # ================================================================
 
-SUPPORTED_CODE_EXTENSIONS = {
+SUPPORTED_CODE_EXTENSIONS = frozenset({
     ".js", ".jsx", ".ts", ".tsx",
     ".java", ".c", ".h", ".cpp", ".cc",
     ".go", ".rs", ".php", ".rb", ".css", ".html"
-}
+})
 
 
-def parse_generic_code_file(file_path):
+def parse_generic_code_file(file_path, raw: bytes):
     """
     Simple, robust fallback chunker:
     - splits file into ~40 line blocks
     - works for ALL languages
+    Block boundaries come from newline byte offsets, so each block is a
+    single slice of the original buffer.
     """
-    try:
-        lines = open(file_path, "r", encoding="utf-8", errors="ignore").readlines()
-    except:
-        return []
+    newlines = np.flatnonzero(np.frombuffer(raw, dtype=np.uint8) == 0x0A)
+    n_newlines = len(newlines)
+
+    # Same line count readlines() gives: a trailing partial line counts
+    n_lines = n_newlines + (1 if raw and not raw.endswith(b"\n") else 0)
 
     chunks = []
     chunk_size = 40
 
-    for i in range(0, len(lines), chunk_size):
-        block = lines[i:i + chunk_size]
-        code = "".join(block)
+    for i in range(0, n_lines, chunk_size):
+        end = min(i + chunk_size, n_lines)
+        byte_start = int(newlines[i - 1]) + 1 if i > 0 else 0
+        byte_end = int(newlines[end - 1]) + 1 if end <= n_newlines else len(raw)
+
+        code = raw[byte_start:byte_end].decode("utf-8", errors="ignore")
         snippet = code[:250].replace("\n", " ")
+        block_len = end - i
 
         chunks.append({
             "kind": "code_block",
             "name": f"block_{i // chunk_size}",
             "file": os.path.basename(file_path),
             "lineno_start": i + 1,
-            "lineno_end": i + len(block),
+            "lineno_end": i + block_len,
             "code": code,
             "text_to_embed": f"""
 Code block from {os.path.basename(file_path)}
-Lines {i + 1} to {i + len(block)}
+Lines {i + 1} to {i + block_len}
 Snippet: {snippet}
 """.strip()
         })
@@ -142,55 +224,125 @@ Snippet: {snippet}
 # === PART 3 — MAIN INGEST FUNCTION ===============================
 # ================================================================
 
-SKIP_EXTENSIONS = {
+SKIP_EXTENSIONS = frozenset({
     ".txt", ".md", ".csv", ".png", ".jpg", ".jpeg",
     ".gif", ".pdf", ".ipynb", ".svg"
-}
+})
 
-SKIP_FOLDERS = {
+SKIP_FOLDERS = frozenset({
     "node_modules", "dist", "build", "__pycache__", ".git", ".idea"
-}
+})
 
 
-def run_ingest(cloned_repo_path):
+def available_cpus():
+    """
+    CPUs this process may actually run on. os.cpu_count() ignores affinity
+    limits; sched_getaffinity is Linux-only, so fall back to it elsewhere.
+    """
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def _file_ext(name):
+    """
+    Lowercased extension incl. the dot ("" for none / dotfiles),
+    same result as os.path.splitext without the tuple allocation.
+    """
+    i = name.rfind(".")
+    return name[i:].lower() if i > 0 else ""
+
+
+def _iter_files(root, skip_folders):
+    """
+    Recursive os.scandir walk — reuses the d_type from readdir instead
+    of stat()ing every entry like os.walk does. Unreadable or vanished
+    directories are skipped, as os.walk did.
+    """
+    try:
+        it = os.scandir(root)
+    except OSError:
+        return
+
+    with it:
+        for entry in it:
+            if entry.is_dir(follow_symlinks=False):
+                if entry.name not in skip_folders:
+                    yield from _iter_files(entry.path, skip_folders)
+            elif entry.is_file():
+                yield entry
+
+
+def process_file(fpath):
+    """
+    Produce all chunks for a single file (file-level + language-specific).
+    Top-level so it can be shipped to worker processes.
+    """
+    file = os.path.basename(fpath)
+    ext = _file_ext(file)
     chunks = []
 
-    for root, dirs, files in os.walk(cloned_repo_path):
-        dirs[:] = [d for d in dirs if d not in SKIP_FOLDERS]
-
-        for file in files:
-            ext = os.path.splitext(file)[1].lower()
-            fpath = os.path.join(root, file)
-
-            if ext in SKIP_EXTENSIONS:
-                continue
-
-            # ---------- File-level chunk ----------
-            try:
-                content = open(fpath, "r", encoding="utf-8", errors="ignore").read()
-                snippet = content[:400].replace("\n", " ")
-
-                chunks.append({
-                    "kind": "file",
-                    "name": file,
-                    "file": file,
-                    "lineno_start": 1,
-                    "lineno_end": content.count("\n") + 1,
-                    "code": content[:2000],
-                    "text_to_embed": f"""
+    # Read + decode once; every parser below reuses `content`
+    try:
+        with open(fpath, "rb") as f:
+            raw = f.read()
+    except OSError:
+        return chunks
+
+    # Normalise CRLF / lone CR to LF, as the old text-mode open() did, so the
+    # newline-offset math in both parsers matches ast's idea of line numbers
+    raw = raw.replace(b"\r\n", b"\n").replace(b"\r", b"\n")
+    content = raw.decode("utf-8", errors="ignore")
+
+    # ---------- File-level chunk ----------
+    snippet = content[:400].replace("\n", " ")
+
+    chunks.append({
+        "kind": "file",
+        "name": file,
+        "file": file,
+        "lineno_start": 1,
+        "lineno_end": content.count("\n") + 1,
+        "code": content[:2000],
+        "text_to_embed": f"""
 File: {file}
 Snippet: {snippet}
 """.strip()
-                })
-            except:
-                pass
+    })
+
+    # ---------- Language-specific ----------
+    # A file that breaks a parser only loses its own symbol chunks;
+    # letting it raise would fail the whole repo via ex.map.
+    try:
+        if ext == ".py":
+            chunks.extend(parse_python_file(fpath, content))
+
+        elif ext in SUPPORTED_CODE_EXTENSIONS:
+            chunks.extend(parse_generic_code_file(fpath, raw))
+    except Exception as e:
+        print(f"[INGEST] Skipping symbols in {fpath}: {type(e).__name__}: {e}")
+
+    return chunks
 
-            # ---------- Language-specific ----------
-            if ext == ".py":
-                chunks.extend(parse_python_file(fpath))
 
-            elif ext in SUPPORTED_CODE_EXTENSIONS:
-                chunks.extend(parse_generic_code_file(fpath))
+def run_ingest(cloned_repo_path):
+    paths = [
+        entry.path
+        for entry in _iter_files(cloned_repo_path, SKIP_FOLDERS)
+        if _file_ext(entry.name) not in SKIP_EXTENSIONS
+    ]
+
+    # Parsing is CPU-bound with no shared state → fan out across processes.
+    # ex.map keeps results in walk order, so chunk indices stay deterministic.
+    # forkserver: don't fork the threaded uvicorn process (and its torch/CUDA
+    # state); workers only need to import this lightweight module.
+    chunks = []
+    with ProcessPoolExecutor(
+        max_workers=max(1, min(available_cpus(), len(paths))),
+        mp_context=multiprocessing.get_context("forkserver"),
+    ) as ex:
+        for sub in ex.map(process_file, paths, chunksize=32):
+            chunks.extend(sub)
 
     print(f"[INGEST] Total chunks extracted: {len(chunks)}")
     return chunks
@@ -14,3 +14,4 @@ class CodeChunk(Base):
     start_line = Column(Integer)
     end_line = Column(Integer)
     code_snippet = Column(Text)
+    content_hash = Column(String(40))  # sha1 of text_to_embed, for embedding reuse
@@ -1,19 +1,23 @@
 # app/query_search.py
 
 import os
+import threading
+from collections import OrderedDict
+
 import faiss
 import numpy as np
-from sentence_transformers import SentenceTransformer
 import google.generativeai as genai
 from dotenv import load_dotenv
 
+from app.build_vector_index import model as embed_model
 from app.db import SessionLocal
 from app.models import CodeChunk
 
 load_dotenv()
 
-MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
 TOP_K = 5
+INDEX_CACHE_SIZE = 64
+HNSW_EF_SEARCH = 64
 
 # ===== GEMINI SETUP =====
 gemini_api_key = os.getenv("GEMINI_API_KEY")
@@ -23,8 +27,44 @@ if not gemini_api_key:
 genai.configure(api_key=gemini_api_key)
 llm = genai.GenerativeModel("gemini-2.5-flash")
 
-# Load embedding model once globally
-embed_model = SentenceTransformer(MODEL_NAME)
+
+# Reusable 1×d float32 query buffer, one per worker thread
+# (sync FastAPI routes run concurrently in a threadpool)
+EMBED_DIM = embed_model.get_sentence_embedding_dimension()
+_thread_local = threading.local()
+
+
+def _query_buffer():
+    buf = getattr(_thread_local, "query_emb", None)
+    if buf is None:
+        buf = _thread_local.query_emb = np.empty((1, EMBED_DIM), dtype=np.float32)
+    return buf
+
+
+# LRU of path -> (mtime, index); one entry per user, replaced when a
+# re-ingest rewrites the file so stale indexes don't linger in memory
+_index_cache = OrderedDict()
+_index_cache_lock = threading.Lock()
+
+
+def _load_index(path: str):
+    mtime = os.path.getmtime(path)
+
+    with _index_cache_lock:
+        cached = _index_cache.get(path)
+        if cached is not None and cached[0] == mtime:
+            _index_cache.move_to_end(path)
+            return cached[1]
+
+    index = faiss.read_index(path)
+
+    with _index_cache_lock:
+        _index_cache[path] = (mtime, index)
+        _index_cache.move_to_end(path)
+        while len(_index_cache) > INDEX_CACHE_SIZE:
+            _index_cache.popitem(last=False)
+
+    return index
 
 
 def answer_question(user_id: str, question: str) -> str:
@@ -49,7 +89,7 @@ def answer_question(user_id: str, question: str) -> str:
         return "No FAISS index found for this user. Please ingest a repository first."
 
     try:
-        index = faiss.read_index(faiss_path)
+        index = _load_index(faiss_path)
     except Exception:
         return "FAISS index is corrupted. Please rebuild by re-ingesting the repository."
 
@@ -57,16 +97,21 @@ def answer_question(user_id: str, question: str) -> str:
     # STEP 2 — Embed the question
     # ===============================
 
-    query_emb = embed_model.encode(
+    query_emb = _query_buffer()
+    np.copyto(query_emb, embed_model.encode(
         [question],
         normalize_embeddings=True,
         convert_to_numpy=True
-    ).astype("float32")
+    ))
 
     # ===============================
     # STEP 3 — Search FAISS
     # ===============================
 
+    # Indexes built before the HNSW switch are plain IndexFlatIP
+    if isinstance(index, faiss.IndexHNSW):
+        index.hnsw.efSearch = HNSW_EF_SEARCH
+
     try:
         _, I = index.search(query_emb, TOP_K)
     except Exception: